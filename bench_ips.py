@@ -0,0 +1,103 @@
+"""
+Benchmark of the IPS writer and reader in libs/patches.py with big synthetic files.
+
+A random source file is created and modified in scattered places (random bytes and runs of repeated bytes) to build
+the target. Then the IPS patch is created, with and without RLE compression, and applied back, checking the result is
+identical to the target.
+
+Usage: python bench_ips.py [size_mib]
+"""
+
+import filecmp
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+import libs.patches as patches
+
+
+# Constants
+#=======================================================================================================================
+i_SIZE_MIB = 16
+i_CHANGES = 20000
+i_SEED = 1234
+
+
+# Functions
+#=======================================================================================================================
+def build_files(pu_source, pu_target, pi_size):
+    """
+    Function to build the synthetic source and target files.
+
+    :param pu_source: Path of the source file.
+    :param pu_target: Path of the target file.
+    :param pi_size: Size of the files in bytes.
+
+    :return: Nothing
+    """
+    o_random = random.Random(i_SEED)
+
+    ab_data = bytearray(os.urandom(pi_size))
+    with open(pu_source, 'wb') as o_file:
+        o_file.write(ab_data)
+
+    for i_change in range(i_CHANGES):
+        i_offset = o_random.randrange(pi_size)
+        i_length = min(o_random.randrange(1, 256), pi_size - i_offset)
+        if o_random.random() < 0.5:
+            ab_data[i_offset:i_offset + i_length] = os.urandom(i_length)
+        else:
+            ab_data[i_offset:i_offset + i_length] = bytearray([o_random.randrange(256)]) * i_length
+
+    with open(pu_target, 'wb') as o_file:
+        o_file.write(ab_data)
+
+
+def _print_result(pu_label, pf_seconds, pi_bytes):
+    f_speed = pi_bytes / (1024.0 * 1024.0) / max(pf_seconds, 1e-9)
+    print('%-28s %8.3f s %9.1f MiB/s' % (pu_label, pf_seconds, f_speed))
+
+
+# Main code
+#=======================================================================================================================
+if __name__ == '__main__':
+    i_size_mib = i_SIZE_MIB
+    if len(sys.argv) > 1:
+        i_size_mib = int(sys.argv[1])
+
+    # IPS offsets are limited to 24 bits.
+    i_size = min(i_size_mib * 1024 * 1024, patches.i_IPS_MAX_OFFSET + 1)
+
+    u_tmp_dir = tempfile.mkdtemp()
+    try:
+        u_source = os.path.join(u_tmp_dir, u'source.bin')
+        u_target = os.path.join(u_tmp_dir, u'target.bin')
+        u_patched = os.path.join(u_tmp_dir, u'patched.bin')
+
+        build_files(u_source, u_target, i_size)
+        print('Files: %i bytes, %i changes' % (i_size, i_CHANGES))
+
+        b_ok = True
+        for b_rle in (True, False):
+            u_patch = os.path.join(u_tmp_dir, u'patch_%s.ips' % (u'rle' if b_rle else u'plain'))
+
+            f_start = time.time()
+            i_patch_size = patches.create_ips(u_source, u_target, u_patch, pb_rle_compress=b_rle)
+            _print_result(u'create (rle=%s)' % b_rle, time.time() - f_start, i_size)
+            print('%-28s %i bytes' % (u'  patch size', i_patch_size))
+
+            f_start = time.time()
+            patches.apply_ips(u_source, u_patch, u_patched)
+            _print_result(u'apply (rle=%s)' % b_rle, time.time() - f_start, i_size)
+
+            if not filecmp.cmp(u_patched, u_target, shallow=False):
+                print('ERROR: Patched file different from the target')
+                b_ok = False
+
+    finally:
+        shutil.rmtree(u_tmp_dir)
+
+    sys.exit(0 if b_ok else 1)
@@ -0,0 +1,172 @@
+"""
+Small benchmark to keep an eye on the cold-start time of patch_apply.py.
+
+It does three things:
+
+  1. Checks that importing patch_apply doesn't pull in the heavy modules (selenium, libs.files). They must be imported
+     lazily, only when the code that needs them runs.
+
+  2. Prints the import time of every top-level import of patch_apply, of patch_apply itself, and of the lazy modules,
+     each one measured in a fresh interpreter. It's a per-module report similar to "python -X importtime", which is
+     not available in Python 2.
+
+  3. Runs "patch_apply.py --help" several times in fresh interpreters and compares the average wall time against a
+     budget.
+
+Usage: python bench_startup.py [runs]
+"""
+
+import ast
+import os
+import subprocess
+import sys
+import time
+
+
+# Constants
+#=======================================================================================================================
+u_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), u'patch_apply.py')
+i_RUNS = 20
+f_BUDGET = 0.150     # Maximum average time in seconds for "patch_apply.py --help"
+
+tu_LAZY_MODULES = (u'selenium', u'libs.files')
+
+# Modules imported by patch_apply only when needed, timed in the report.
+tu_REPORT_LAZY_MODULES = (u'libs.files', u'libs.patches', u'selenium.webdriver')
+i_REPORT_RUNS = 5
+
+
+# Functions
+#=======================================================================================================================
+def check_lazy_imports():
+    """
+    Function to check that importing patch_apply doesn't import the heavy modules.
+
+    :return: A list with the names of the heavy modules that were imported. Empty when everything is fine.
+    """
+    u_code = (u'import sys; sys.path.insert(0, %r); import patch_apply; '
+              u'print(",".join(sorted(sys.modules)))') % os.path.dirname(u_SCRIPT)
+    u_output = subprocess.check_output([sys.executable, u'-c', u_code]).decode('utf8')
+    lu_modules = u_output.strip().split(u',')
+
+    lu_loaded = []
+    for u_lazy_module in tu_LAZY_MODULES:
+        for u_module in lu_modules:
+            if u_module == u_lazy_module or u_module.startswith(u'%s.' % u_lazy_module):
+                lu_loaded.append(u_lazy_module)
+                break
+
+    return lu_loaded
+
+
+def get_top_level_imports():
+    """
+    Function to get the modules imported at the top level of patch_apply.py, the ones paid by every invocation.
+
+    :return: A list with the names of the modules.
+    """
+    with open(u_SCRIPT, 'r') as o_file:
+        o_tree = ast.parse(o_file.read())
+
+    lu_modules = []
+    for o_node in o_tree.body:
+        if isinstance(o_node, ast.Import):
+            lu_modules += [o_alias.name for o_alias in o_node.names]
+        elif isinstance(o_node, ast.ImportFrom):
+            lu_modules.append(o_node.module)
+
+    return lu_modules
+
+
+def time_import(pu_module, pi_runs):
+    """
+    Function to measure the time needed to import a module (including everything it imports) in fresh interpreters.
+
+    :param pu_module: Name of the module. e.g. u'libs.files'
+    :param pi_runs: Number of runs, the best one is returned.
+
+    :return: The time in seconds, or None if the module can't be imported.
+    """
+    u_code = (u'import sys, time; sys.path.insert(0, %r); f_start = time.time()\n'
+              u'try:\n'
+              u'    import %s\n'
+              u'    print(time.time() - f_start)\n'
+              u'except ImportError:\n'
+              u'    print(-1)') % (os.path.dirname(u_SCRIPT), pu_module)
+
+    lf_times = []
+    for i_run in range(pi_runs):
+        f_time = float(subprocess.check_output([sys.executable, u'-c', u_code]))
+        if f_time < 0:
+            return None
+        lf_times.append(f_time)
+
+    return min(lf_times)
+
+
+def print_import_report(pi_runs):
+    """
+    Function to print the import time of the modules used by patch_apply.py.
+
+    :param pi_runs: Number of runs for each module.
+
+    :return: Nothing
+    """
+    ltu_modules = [(u_module, u'startup') for u_module in get_top_level_imports()]
+    ltu_modules.append((u'patch_apply', u'startup total'))
+    ltu_modules += [(u_module, u'lazy') for u_module in tu_REPORT_LAZY_MODULES]
+
+    print('Import times (fresh interpreter, best of %i runs):' % pi_runs)
+    for u_module, u_kind in ltu_modules:
+        f_time = time_import(u_module, pi_runs)
+        if f_time is None:
+            u_time = u'not installed'
+        else:
+            u_time = u'%.2f ms' % (f_time * 1000)
+        print('  %-20s %-14s %s' % (u_module, u_kind, u_time))
+
+
+def time_help(pi_runs):
+    """
+    Function to measure the average time of "patch_apply.py --help" in fresh interpreters.
+
+    :param pi_runs: Number of runs.
+    :type pi_runs: int
+
+    :return: Average time in seconds.
+    """
+    with open(os.devnull, 'w') as o_null:
+        f_total = 0.0
+        for i_run in range(pi_runs):
+            f_start = time.time()
+            subprocess.call([sys.executable, u_SCRIPT, u'--help'], stdout=o_null, stderr=o_null)
+            f_total += time.time() - f_start
+
+    return f_total / pi_runs
+
+
+# Main code
+#=======================================================================================================================
+if __name__ == '__main__':
+    i_runs = i_RUNS
+    if len(sys.argv) > 1:
+        i_runs = int(sys.argv[1])
+
+    b_ok = True
+
+    lu_loaded = check_lazy_imports()
+    if lu_loaded:
+        print('ERROR: Heavy modules imported at startup: %s' % u', '.join(lu_loaded))
+        b_ok = False
+    else:
+        print('Lazy imports: OK')
+
+    print_import_report(i_REPORT_RUNS)
+
+    f_average = time_help(i_runs)
+    print('Startup time: %.1f ms (budget %.1f ms, %i runs)' % (f_average * 1000, f_BUDGET * 1000, i_runs))
+    if f_average > f_BUDGET:
+        print('ERROR: Startup time over budget')
+        b_ok = False
+
+    sys.exit(0 if b_ok else 1)
@@ -15,13 +15,28 @@ Description: Library with file tools.
              2019-03-09 - Fixed bug in FilePath initialization so when joining back the elements of an absolute path
                           (e.g. '/home/john/my_file.txt'), the result would miss the leading dash (e.g.
                           'home/john/my_file.txt). Added two new methods in FilePath: common_prefix and uncommon_prefix.
+
+             2020-02-24 - Added ROM fingerprinting (CRC32, MD5 and SHA-1 computed reading the file only once) with
+                          get_fingerprint() and get_fingerprints(), the latter hashing the files in a thread pool.
+
+             2020-02-26 - FilePath uses __slots__ and caches its lowercase extension the first time it's requested.
+                          content() matches extensions against a set of lowercase extensions built once. Useful when
+                          holding hundreds of thousands of objects for library scans.
 """
 
 import codecs
 import datetime
+import hashlib
 import os
 import string
 import time
+import zlib
+
+
+# Constants
+# =======================================================================================================================
+i_HASH_BLOCK = 4 * 1024 * 1024      # Size of the blocks read from disk when hashing files (bytes)
+i_HASH_THREADS = 4                  # Default number of threads used by get_fingerprints()
 
 
 # Classes
@@ -163,10 +178,40 @@ class BackReader:
         self._o_file.seek(0, 2)
 
 
+class Fingerprint(object):
+    """
+    Class to store the size and hashes of a file, the ones used by No-Intro/Redump DATs to identify ROMs.
+    """
+
+    def __init__(self, pu_path=u''):
+        self.u_path = pu_path
+        self.i_size = 0
+        self.u_crc32 = u''
+        self.u_md5 = u''
+        self.u_sha1 = u''
+        self.u_error = u''      # Reason why the file couldn't be hashed, empty when everything went fine.
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __unicode__(self):
+        u_out = u'<Fingerprint>\n'
+        u_out += u'  .u_path:  %s\n' % self.u_path
+        u_out += u'  .i_size:  %i\n' % self.i_size
+        u_out += u'  .u_crc32: %s\n' % self.u_crc32
+        u_out += u'  .u_md5:   %s\n' % self.u_md5
+        u_out += u'  .u_sha1:  %s\n' % self.u_sha1
+        u_out += u'  .u_error: %s\n' % self.u_error
+        return u_out
+
+
 class FilePath(object):
     """
     Class to handle file information: FilePath name, root, extension, etc...
     """
+    # No __dict__ per instance. Only the lowercase extension, used by the extension filters, is cached (None means "not
+    # computed yet"); the rest of the parts of the path are cheap and computed on demand.
+    __slots__ = ('_u_path', '_u_ext_lower')
 
     def __init__(self, *u_path):
         self.u_path = os.sep.join(u_path)
@@ -177,6 +222,14 @@ class FilePath(object):
             b_equal = True
         return b_equal
 
+    def __getstate__(self):
+        # Classes with __slots__ can't be pickled by the default protocol without these two methods. A tuple is used
+        # because an empty state (e.g. an empty path) would make pickle skip __setstate__.
+        return (self._u_path,)
+
+    def __setstate__(self, ptu_state):
+        self.u_path = ptu_state[0]
+
     def __str__(self):
         return unicode(self).encode('utf8')
 
@@ -201,6 +254,18 @@ class FilePath(object):
         # the path is relative.
         return self.u_path.split(os.sep)
 
+    def _get_u_path(self):
+        return self._u_path
+
+    def _set_u_path(self, pu_path):
+        """
+        Method to set the path. The cached lowercase extension is cleared.
+        :param pu_path:
+        :return:
+        """
+        self._u_path = pu_path
+        self._u_ext_lower = None
+
     def _get_o_root(self):
         return FilePath(os.path.dirname(self.u_path))
 
@@ -230,6 +295,23 @@ class FilePath(object):
             u_ext = u''
         return u_ext
 
+    def _get_u_ext_lower(self):
+        if self._u_ext_lower is None:
+            self._u_ext_lower = self._get_u_ext().lower()
+        return self._u_ext_lower
+
+    def _has_ext_in(self, psu_exts_lower):
+        """
+        Method to check if the lowercase extension of the file is in a set of lowercase extensions. Used by content()
+        so the set is built only once for all the elements.
+
+        :param psu_exts_lower: Set of lowercase extensions. i.e. {u'jpg', u'png'}
+        :type psu_exts_lower: Set[unicode]
+
+        :return: True/False
+        """
+        return self._get_u_ext_lower() in psu_exts_lower
+
     def _get_size(self):
         """
         Method to get the file size in bytes.
@@ -348,8 +430,9 @@ class FilePath(object):
             lo_ext_clean_elements_fp = lo_type_clean_elems_fp
 
         else:
-            for o_elem_fp in lo_elems_fp:
-                if o_elem_fp.has_exts(*ptu_exts):
+            su_exts_lower = _get_exts_lower(ptu_exts)
+            for o_elem_fp in lo_type_clean_elems_fp:
+                if o_elem_fp._has_ext_in(su_exts_lower):
                     lo_ext_clean_elements_fp.append(o_elem_fp)
 
         return lo_ext_clean_elements_fp
@@ -400,10 +483,12 @@ class FilePath(object):
                  result).
         """
 
+        u_ext_lower = self._get_u_ext_lower()
+
         b_has_ext = False
 
         for u_ext in plu_exts:
-            if self.u_ext.lower() == u_ext.lower():
+            if u_ext_lower == u_ext.lower():
                 b_has_ext = True
                 break
 
@@ -534,6 +619,7 @@ class FilePath(object):
     lu_elements = property(fget=_get_elems)
     o_mod_time = property(fget=_get_mod_time)
     o_root = property(fget=_get_o_root)
+    u_path = property(fget=_get_u_path, fset=_set_u_path)
     u_root = property(fget=_get_u_root)
     u_file = property(fget=_get_u_full_file)
     u_name = property(fget=_get_u_name)
@@ -543,6 +629,15 @@ class FilePath(object):
 
 # Functions
 # =======================================================================================================================
+def _get_exts_lower(plu_exts):
+    """
+    Function to get a set with the lowercase version of several extensions.
+    :param plu_exts: Extensions. e.g. (u'JPG', u'png')
+    :return: A set of unicode strings. e.g. {u'jpg', u'png'}
+    """
+    return set(u_ext.lower() for u_ext in plu_exts)
+
+
 def _sizeof_fmt(i_number, pi_jump=1024, pu_suffix=u'B'):
     """
     Function to convert integer numbers to human readable format
@@ -582,6 +677,94 @@ def _sizeof_fmt(i_number, pi_jump=1024, pu_suffix=u'B'):
     return u_out
 
 
+def get_fingerprint(po_file_fp, pi_block=i_HASH_BLOCK):
+    """
+    Function to get the CRC32, MD5 and SHA-1 of a file. The file is read only once, in big blocks, and every block is
+    fed to the three hashers.
+
+    :param po_file_fp: File to hash.
+    :param pi_block: Size of the blocks read from disk in bytes.
+
+    :type po_file_fp: FilePath
+    :type pi_block: int
+
+    :return: A Fingerprint object.
+    """
+    o_fingerprint = Fingerprint(po_file_fp.u_path)
+
+    i_crc32 = 0
+    o_md5 = hashlib.md5()
+    o_sha1 = hashlib.sha1()
+    i_size = 0
+
+    with open(po_file_fp.u_path, 'rb') as o_file:
+        while True:
+            s_block = o_file.read(pi_block)
+            if not s_block:
+                break
+            i_crc32 = zlib.crc32(s_block, i_crc32)
+            o_md5.update(s_block)
+            o_sha1.update(s_block)
+            i_size += len(s_block)
+
+    o_fingerprint.i_size = i_size
+    o_fingerprint.u_crc32 = u'%08x' % (i_crc32 & 0xffffffff)
+    o_fingerprint.u_md5 = o_md5.hexdigest().decode('ascii')
+    o_fingerprint.u_sha1 = o_sha1.hexdigest().decode('ascii')
+
+    return o_fingerprint
+
+
+def get_fingerprints(plo_files_fp, pi_threads=i_HASH_THREADS, pi_block=i_HASH_BLOCK):
+    """
+    Function to get the fingerprints of several files using a pool of threads. Reading from disk and the MD5/SHA-1
+    updates release the GIL, so they overlap between threads. In Python 2, zlib.crc32 doesn't release it, so the CRC32
+    part is still computed by one thread at a time.
+
+    A file that can't be read doesn't stop the rest, its Fingerprint is returned with u_error set.
+
+    Typical usage with a directory tree:
+
+        lo_files_fp = FilePath(u'/home/john/roms').content(pb_recursive=True, ps_type='files')
+        lo_fingerprints = get_fingerprints(lo_files_fp)
+
+    :param plo_files_fp: List of FilePath objects to hash. They must be files.
+    :param pi_threads: Number of threads.
+    :param pi_block: Size of the blocks read from disk in bytes.
+
+    :type plo_files_fp: List[FilePath]
+    :type pi_threads: int
+    :type pi_block: int
+
+    :return: A list of Fingerprint objects in the same order than the input files.
+    """
+    if pi_threads < 1:
+        raise ValueError('Invalid number of threads "%s"' % pi_threads)
+
+    def _get_fingerprint_safe(po_file_fp):
+        try:
+            o_fingerprint = get_fingerprint(po_file_fp, pi_block)
+        except (IOError, OSError) as o_error:
+            o_fingerprint = Fingerprint(po_file_fp.u_path)
+            o_fingerprint.u_error = unicode(o_error.strerror or o_error)
+        return o_fingerprint
+
+    if pi_threads == 1 or len(plo_files_fp) < 2:
+        lo_fingerprints = [_get_fingerprint_safe(o_file_fp) for o_file_fp in plo_files_fp]
+
+    else:
+        from multiprocessing.pool import ThreadPool
+
+        o_pool = ThreadPool(min(pi_threads, len(plo_files_fp)))
+        try:
+            lo_fingerprints = o_pool.map(_get_fingerprint_safe, plo_files_fp, chunksize=1)
+        finally:
+            o_pool.close()
+            o_pool.join()
+
+    return lo_fingerprints
+
+
 def get_cwd():
     """
     Function to get the current working directory.
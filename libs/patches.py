@@ -0,0 +1,884 @@
+# -*- coding: utf-8 -*-
+
+"""
+Description: Library to apply ROM patches natively, without the browser.
+    Version: 2020-02-23
+
+        Log: 2020-02-23 - First version. UPS patches are applied in fixed-size chunks, in patch-offset order, writing a
+                          small checkpoint file after every chunk so an interrupted job can continue where it stopped.
+
+             2020-02-25 - Added the ROM pre-check. The ROM is compared against the source size and CRC32
+                          stored in the patch using an offset view (skipping the 512-byte header) instead of a modified
+                          copy of the file. Adding headers is not supported, real copier headers aren't blank so a
+                          made-up one would never match the CRC32 expected by the patch.
+
+             2020-02-27 - Added IPS support. Patches are read record by record from a buffered file and applied in
+                          order, so the memory used is bounded by the biggest record (64 KiB), including the truncate
+                          extension after the EOF marker. IPS patches can also be created, using RLE records for runs
+                          of repeated bytes.
+"""
+
+import binascii
+import os
+import struct
+import zlib
+
+
+# Constants
+# =======================================================================================================================
+i_CHUNK_SIZE = 16 * 1024 * 1024     # Default size of the chunks written to the output file (bytes)
+i_BUFFER_SIZE = 1024 * 1024         # Buffer size used when reading the patch file (bytes)
+
+u_CHECKPOINT_EXT = u'ckpt'
+u_BAD_EXT = u'bad'                  # Extension added to output files that failed the final CRC32 verification
+
+i_COPIER_HEADER_SIZE = 512
+i_PRECHECK_CRC_MAX_SIZE = 64 * 1024 * 1024  # Bigger ROMs are only CRC32-checked by get_rom_offset() when requested
+
+s_UPS_MAGIC = b'UPS1'
+
+s_IPS_MAGIC = b'PATCH'
+s_IPS_EOF = b'EOF'
+i_IPS_EOF_OFFSET = 0x454f46         # "EOF" read as an offset, a record can't start there
+i_IPS_MAX_OFFSET = 0xffffff
+i_IPS_MAX_SIZE = 0xffff
+i_IPS_MAX_GAP = 4                   # Unchanged bytes kept inside a record instead of starting a new one (5-byte header)
+i_IPS_RLE_MIN = 14                  # Min run length for a RLE record in the middle of a record (8 + 5 header bytes)
+i_IPS_RLE_MIN_EDGE = 9              # Same, at the start or end of a record (8 header bytes)
+i_IPS_COMPARE_BLOCK = 64            # Unchanged blocks of this size are skipped without comparing byte by byte
+
+
+# Classes
+# =======================================================================================================================
+class UpsPatch(object):
+    """
+    Class to read an UPS patch. Only the header and the footer are read when the object is created, the records are
+    read incrementally by iter_records().
+    """
+
+    def __init__(self, pu_file):
+        self.u_file = pu_file
+        self.i_source_size = 0
+        self.i_target_size = 0
+        self.i_source_crc32 = 0
+        self.i_target_crc32 = 0
+        self.i_patch_crc32 = 0
+
+        self._i_records_start = 0
+        self._i_records_end = 0
+
+        self._read_header()
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __unicode__(self):
+        u_out = u'<UpsPatch>\n'
+        u_out += u'  .u_file:         %s\n' % self.u_file
+        u_out += u'  .i_source_size:  %i\n' % self.i_source_size
+        u_out += u'  .i_target_size:  %i\n' % self.i_target_size
+        u_out += u'  .i_source_crc32: %08x\n' % self.i_source_crc32
+        u_out += u'  .i_target_crc32: %08x\n' % self.i_target_crc32
+        u_out += u'  .i_patch_crc32:  %08x\n' % self.i_patch_crc32
+        return u_out
+
+    def _read_header(self):
+        # Magic, two one-byte sizes at least, and the three CRC32.
+        if os.path.getsize(self.u_file) < len(s_UPS_MAGIC) + 2 + 12:
+            raise ValueError('Truncated UPS patch "%s"' % self.u_file)
+
+        with open(self.u_file, 'rb') as o_file:
+            if o_file.read(4) != s_UPS_MAGIC:
+                raise ValueError('Not a valid UPS patch "%s"' % self.u_file)
+
+            self.i_source_size = _read_varint(o_file)
+            self.i_target_size = _read_varint(o_file)
+            self._i_records_start = o_file.tell()
+
+            # The last 12 bytes of the patch are the CRC32 of the source, the target, and the patch itself.
+            o_file.seek(-12, 2)
+            self._i_records_end = o_file.tell()
+            self.i_source_crc32, self.i_target_crc32, self.i_patch_crc32 = struct.unpack('<III', o_file.read(12))
+
+        if self._i_records_end < self._i_records_start:
+            raise ValueError('Truncated UPS patch "%s"' % self.u_file)
+
+    def iter_records(self):
+        """
+        Method to iterate over the records of the patch in offset order. The patch is read in blocks of i_BUFFER_SIZE
+        bytes and the records are cut from them, instead of reading byte by byte.
+
+        :return: A generator of tuples (offset, xor_data) where offset is the absolute offset in the target file and
+                 xor_data is a string of bytes to be xored with the source data at that offset.
+        """
+        with open(self.u_file, 'rb') as o_file:
+            o_file.seek(self._i_records_start)
+            i_left = self._i_records_end - self._i_records_start
+
+            s_buffer = b''
+            i_pos = 0
+            i_offset = 0
+            while True:
+                # A varint is never longer than 10 bytes, so 16 available bytes are enough to decode it.
+                if len(s_buffer) - i_pos < 16 and i_left:
+                    s_block = o_file.read(min(i_BUFFER_SIZE, i_left))
+                    i_left -= len(s_block)
+                    s_buffer = s_buffer[i_pos:] + s_block
+                    i_pos = 0
+
+                if i_pos >= len(s_buffer):
+                    break
+
+                i_skip, i_pos = _decode_varint(s_buffer, i_pos)
+                i_offset += i_skip
+
+                i_search = i_pos
+                i_zero = s_buffer.find(b'\x00', i_search)
+                while i_zero == -1:
+                    if not i_left:
+                        raise ValueError('Truncated UPS patch "%s"' % self.u_file)
+                    s_block = o_file.read(min(i_BUFFER_SIZE, i_left))
+                    i_left -= len(s_block)
+                    i_search = len(s_buffer) - i_pos
+                    s_buffer = s_buffer[i_pos:] + s_block
+                    i_pos = 0
+                    i_zero = s_buffer.find(b'\x00', i_search)
+
+                s_xor = s_buffer[i_pos:i_zero]
+                i_pos = i_zero + 1
+
+                yield i_offset, s_xor
+
+                # The terminating zero also counts as a (not modified) byte of the target file.
+                i_offset += len(s_xor) + 1
+
+
+class IpsPatch(object):
+    """
+    Class to read an IPS patch. The records are read incrementally by iter_records(), the patch is never fully loaded
+    in memory.
+    """
+
+    def __init__(self, pu_file):
+        self.u_file = pu_file
+        self.i_truncate = None      # Size of the target file when the patch uses the truncate extension. Only
+                                    # available after iterating over all the records.
+
+        with open(self.u_file, 'rb') as o_file:
+            if o_file.read(len(s_IPS_MAGIC)) != s_IPS_MAGIC:
+                raise ValueError('Not a valid IPS patch "%s"' % self.u_file)
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __unicode__(self):
+        u_out = u'<IpsPatch>\n'
+        u_out += u'  .u_file:     %s\n' % self.u_file
+        u_out += u'  .i_truncate: %s\n' % self.i_truncate
+        return u_out
+
+    def _read(self, po_file, pi_size):
+        s_data = po_file.read(pi_size)
+        if len(s_data) != pi_size:
+            raise ValueError('Truncated IPS patch "%s"' % self.u_file)
+        return s_data
+
+    def iter_records(self):
+        """
+        Method to iterate over the records of the patch in the order they are stored.
+
+        :return: A generator of tuples (offset, data) where offset is the absolute offset in the target file and data
+                 is a bytearray with the bytes to write at that offset. RLE records are returned already expanded.
+        """
+        self.i_truncate = None
+
+        with open(self.u_file, 'rb', i_BUFFER_SIZE) as o_file:
+            o_file.seek(len(s_IPS_MAGIC))
+            while True:
+                s_offset = self._read(o_file, 3)
+                if s_offset == s_IPS_EOF:
+                    break
+
+                i_offset = struct.unpack('>I', b'\x00' + s_offset)[0]
+                i_size = struct.unpack('>H', self._read(o_file, 2))[0]
+
+                if i_size:
+                    ab_data = bytearray(self._read(o_file, i_size))
+                else:
+                    i_rle_size = struct.unpack('>H', self._read(o_file, 2))[0]
+                    ab_data = bytearray(self._read(o_file, 1) * i_rle_size)
+
+                yield i_offset, ab_data
+
+            # Truncate extension, three extra bytes after the EOF marker with the final size of the target.
+            s_truncate = o_file.read(3)
+            if len(s_truncate) == 3:
+                self.i_truncate = struct.unpack('>I', b'\x00' + s_truncate)[0]
+
+
+class Checkpoint(object):
+    """
+    Class to store the progress of a chunked patching job: the last completed offset of the output file, and the
+    rolling CRC32 of the output data up to that offset. The expected CRC32 of the target is also stored to avoid
+    resuming a job with a different patch.
+    """
+
+    def __init__(self, pu_file):
+        self.u_file = pu_file
+        self.i_offset = 0
+        self.i_crc32 = 0
+        self.i_target_crc32 = None
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __unicode__(self):
+        u_out = u'<Checkpoint>\n'
+        u_out += u'  .u_file:         %s\n' % self.u_file
+        u_out += u'  .i_offset:       %i\n' % self.i_offset
+        u_out += u'  .i_crc32:        %08x\n' % self.i_crc32
+        u_out += u'  .i_target_crc32: %s\n' % self.i_target_crc32
+        return u_out
+
+    def delete(self):
+        if os.path.isfile(self.u_file):
+            os.remove(self.u_file)
+
+    def read(self):
+        """
+        Method to read the checkpoint from disk.
+
+        :return: True if the checkpoint file existed and was valid, False in other case.
+        """
+        b_read = False
+        if os.path.isfile(self.u_file):
+            with open(self.u_file, 'rb') as o_file:
+                ls_fields = o_file.read().split()
+
+            try:
+                self.i_offset = int(ls_fields[0])
+                self.i_crc32 = int(ls_fields[1], 16)
+                self.i_target_crc32 = int(ls_fields[2], 16)
+                b_read = True
+            except (IndexError, ValueError):
+                self.i_offset = 0
+                self.i_crc32 = 0
+                self.i_target_crc32 = None
+
+        return b_read
+
+    def write(self):
+        """
+        Method to write the checkpoint to disk. A temp file is written first and then renamed, so the checkpoint file
+        is never left half-written.
+
+        :return: Nothing
+        """
+        u_tmp_file = u'%s.tmp' % self.u_file
+        with open(u_tmp_file, 'wb') as o_file:
+            o_file.write(b'%i %08x %08x\n' % (self.i_offset, self.i_crc32, self.i_target_crc32))
+            o_file.flush()
+            os.fsync(o_file.fileno())
+        os.rename(u_tmp_file, self.u_file)
+
+
+# Functions
+# =======================================================================================================================
+def _read_varint(po_file):
+    """
+    Function to read an UPS/BPS variable-length integer from a file.
+
+    :param po_file: File object opened in binary mode.
+
+    :return: The integer.
+    """
+    i_data = 0
+    i_shift = 1
+    while True:
+        s_byte = po_file.read(1)
+        if not s_byte:
+            raise ValueError('Unexpected end of file reading variable-length integer')
+        i_byte = ord(s_byte)
+        i_data += (i_byte & 0x7f) * i_shift
+        if i_byte & 0x80:
+            break
+        i_shift <<= 7
+        i_data += i_shift
+    return i_data
+
+
+def _decode_varint(ps_buffer, pi_pos):
+    """
+    Function to decode an UPS/BPS variable-length integer from a string of bytes.
+
+    :param ps_buffer: String of bytes.
+    :param pi_pos: Position of the integer in the string.
+
+    :return: A tuple (integer, position after the integer).
+    """
+    i_data = 0
+    i_shift = 1
+    while True:
+        if pi_pos >= len(ps_buffer):
+            raise ValueError('Unexpected end of data reading variable-length integer')
+        i_byte = ord(ps_buffer[pi_pos])
+        pi_pos += 1
+        i_data += (i_byte & 0x7f) * i_shift
+        if i_byte & 0x80:
+            break
+        i_shift <<= 7
+        i_data += i_shift
+    return i_data, pi_pos
+
+
+def _xor(ps_data_a, ps_data_b):
+    """
+    Function to xor two strings of bytes of the same length. Both are converted to long integers so the operation is
+    done in C instead of byte by byte.
+
+    :param ps_data_a: String of bytes.
+    :param ps_data_b: String of bytes.
+
+    :return: A string of bytes.
+    """
+    i_size = len(ps_data_a)
+    if not i_size:
+        return b''
+    i_xor = long(binascii.hexlify(ps_data_a), 16) ^ long(binascii.hexlify(ps_data_b), 16)
+    return binascii.unhexlify(b'%0*x' % (i_size * 2, i_xor))
+
+
+def _read_view(po_file, pi_start, pi_size, pi_offset=0):
+    """
+    Function to read data from an offset view of a file, without creating any modified copy of it. The offset is the
+    number of bytes skipped at the beginning of the file (e.g. to remove a copier header).
+
+    :param po_file: File object opened in binary mode.
+    :param pi_start: Start position inside the view.
+    :param pi_size: Number of bytes to read.
+    :param pi_offset: Offset of the view.
+
+    :return: A bytearray with the data. It can be shorter than pi_size when reaching the end of the file.
+    """
+    po_file.seek(pi_start + pi_offset)
+    return bytearray(po_file.read(pi_size))
+
+
+def get_view_crc32(pu_file, pi_offset=0, pi_size=None):
+    """
+    Function to get the CRC32 of an offset view of a file. See _read_view() for the meaning of the offset.
+
+    :param pu_file: Path of the file.
+    :param pi_offset: Offset of the view.
+    :param pi_size: Number of bytes of the file to include. None means until the end of the file.
+
+    :return: The CRC32 as an integer.
+    """
+    i_crc32 = 0
+    with open(pu_file, 'rb') as o_file:
+        o_file.seek(pi_offset)
+        i_left = pi_size
+        while i_left is None or i_left > 0:
+            i_read = i_BUFFER_SIZE if i_left is None else min(i_BUFFER_SIZE, i_left)
+            s_block = o_file.read(i_read)
+            if not s_block:
+                break
+            i_crc32 = zlib.crc32(s_block, i_crc32)
+            if i_left is not None:
+                i_left -= len(s_block)
+
+    return i_crc32 & 0xffffffff
+
+
+def write_view(pu_file, pu_out, pi_offset=0):
+    """
+    Function to write an offset view of a file to a new file. Only needed when the view has to be used by an external
+    tool (e.g. the browser), the native engine reads the view directly.
+
+    :param pu_file: Path of the file.
+    :param pu_out: Path of the output file.
+    :param pi_offset: Offset of the view.
+
+    :return: Nothing
+    """
+    with open(pu_file, 'rb') as o_file, open(pu_out, 'wb') as o_out:
+        o_file.seek(pi_offset)
+        while True:
+            s_block = o_file.read(i_BUFFER_SIZE)
+            if not s_block:
+                break
+            o_out.write(s_block)
+
+
+def has_copier_header(pi_size):
+    """
+    Function to guess if a SNES ROM has a 512-byte copier header from its size. ROM sizes are multiples of 1024 bytes,
+    so an extra 512 bytes means a header.
+
+    :param pi_size: Size of the ROM in bytes.
+
+    :return: True/False
+    """
+    return pi_size % 1024 == i_COPIER_HEADER_SIZE
+
+
+def get_patch_format(pu_patch):
+    """
+    Function to get the format of a patch from its first bytes.
+
+    :param pu_patch: Path of the patch.
+
+    :return: u'ups', u'ips', or None for unknown formats.
+    """
+    with open(pu_patch, 'rb') as o_file:
+        s_magic = o_file.read(len(s_IPS_MAGIC))
+
+    u_format = None
+    if s_magic.startswith(s_UPS_MAGIC):
+        u_format = u'ups'
+    elif s_magic == s_IPS_MAGIC:
+        u_format = u'ips'
+
+    return u_format
+
+
+def get_source_info(pu_patch):
+    """
+    Function to get the expected size and CRC32 of the source ROM stored in a patch.
+
+    :param pu_patch: Path of the patch.
+
+    :return: A tuple (size, crc32), or None when the patch format doesn't store that information.
+    """
+    ti_info = None
+    if get_patch_format(pu_patch) == u'ups':
+        o_patch = UpsPatch(pu_patch)
+        ti_info = (o_patch.i_source_size, o_patch.i_source_crc32)
+
+    return ti_info
+
+
+def get_rom_offset(pu_rom, pi_source_size, pi_source_crc32, pb_force_crc=False):
+    """
+    Function to find the offset view of a ROM (see _read_view()) that matches the source expected by a patch:
+
+        - 0: the ROM matches as it is.
+        - 512: the ROM has a copier header the patch doesn't expect, it must be skipped.
+
+    The size is checked first, so only one candidate is possible and the ROM is read at most once. The CRC32 is always
+    checked for ROMs up to i_PRECHECK_CRC_MAX_SIZE bytes (SNES ROMs take milliseconds) and for headered ROMs. For bigger
+    ROMs with the right size it's only checked when pb_force_crc is True; the native UPS engine doesn't need it because
+    it verifies the CRC32 of the result, and reading a multi-GB image twice would make the pre-check too slow.
+
+    :param pu_rom: Path of the ROM.
+    :param pi_source_size: Expected size of the source.
+    :param pi_source_crc32: Expected CRC32 of the source.
+    :param pb_force_crc: Check the CRC32 no matter the size of the ROM.
+
+    :return: The offset as an integer, or None if the ROM doesn't match the patch.
+    """
+    i_rom_size = os.path.getsize(pu_rom)
+
+    i_candidate = None
+    b_check_crc = True
+    if i_rom_size == pi_source_size:
+        i_candidate = 0
+        b_check_crc = pb_force_crc or i_rom_size <= i_PRECHECK_CRC_MAX_SIZE
+    elif i_rom_size - i_COPIER_HEADER_SIZE == pi_source_size and has_copier_header(i_rom_size):
+        i_candidate = i_COPIER_HEADER_SIZE
+
+    i_offset = None
+    if i_candidate is not None:
+        if not b_check_crc or get_view_crc32(pu_rom, i_candidate) == pi_source_crc32:
+            i_offset = i_candidate
+
+    return i_offset
+
+
+def is_same_file(pu_file_a, pu_file_b):
+    """
+    Function to check if two paths point to the same file, following links. Used to refuse jobs where the output would
+    overwrite the ROM before it's read.
+
+    :param pu_file_a: Path of the first file.
+    :param pu_file_b: Path of the second file.
+
+    :return: True/False
+    """
+    if os.path.exists(pu_file_a) and os.path.exists(pu_file_b):
+        b_same = os.path.samefile(pu_file_a, pu_file_b)
+    else:
+        b_same = os.path.realpath(pu_file_a) == os.path.realpath(pu_file_b)
+    return b_same
+
+
+def get_checkpoint_path(pu_patched):
+    """
+    Function to get the path of the checkpoint file for an output file.
+
+    :param pu_patched: Path of the patched output file. e.g. /home/john/final_result.iso
+
+    :return: The path of the checkpoint file. e.g. /home/john/final_result.iso.ckpt
+    """
+    return u'%s.%s' % (pu_patched, u_CHECKPOINT_EXT)
+
+
+def apply_ups_chunked(pu_rom, pu_patch, pu_patched, pi_chunk_size=i_CHUNK_SIZE, pf_callback=None, pi_rom_offset=0):
+    """
+    Function to apply an UPS patch writing the output in fixed-size chunks. After each chunk, the output file is
+    synced to disk and a checkpoint file is written (see get_checkpoint_path()). If a valid checkpoint for the same
+    patch is found when starting, and the data already written matches the CRC32 stored in it, the job continues from
+    the last completed offset. The CRC32 of the final result is always verified against the target CRC32 stored in the
+    patch; when it doesn't match, the output is renamed with the extension u_BAD_EXT. The ROM and the output must be
+    different files.
+
+    :param pu_rom: Path of the ROM to patch.
+    :param pu_patch: Path of the UPS patch.
+    :param pu_patched: Path of the output patched file.
+    :param pi_chunk_size: Size of the chunks in bytes.
+    :param pf_callback: Optional function called after each chunk with two parameters, the completed offset and the
+                        total size.
+    :param pi_rom_offset: Offset view of the ROM (see get_rom_offset()) to strip a copier header.
+
+    :type pu_rom: unicode
+    :type pu_patch: unicode
+    :type pu_patched: unicode
+    :type pi_chunk_size: int
+    :type pi_rom_offset: int
+
+    :return: A tuple (crc32, resumed_offset) with the CRC32 of the patched file and the offset the job was resumed from
+             (0 when it started from the beginning).
+    """
+    if pi_chunk_size <= 0:
+        raise ValueError('Invalid chunk size "%s"' % pi_chunk_size)
+
+    if is_same_file(pu_rom, pu_patched):
+        raise ValueError('The ROM and the output are the same file "%s"' % pu_patched)
+
+    o_patch = UpsPatch(pu_patch)
+    i_total = o_patch.i_target_size
+
+    # [1/4] Loading the checkpoint, if any
+    # -------------------------------------
+    o_checkpoint = Checkpoint(get_checkpoint_path(pu_patched))
+    b_resume = (o_checkpoint.read()
+                and o_checkpoint.i_target_crc32 == o_patch.i_target_crc32
+                and o_checkpoint.i_offset <= i_total
+                and os.path.isfile(pu_patched)
+                and os.path.getsize(pu_patched) >= o_checkpoint.i_offset)
+
+    # The output file could have been modified after the checkpoint was written, so the data is verified again.
+    if b_resume:
+        b_resume = get_view_crc32(pu_patched, pi_size=o_checkpoint.i_offset) == o_checkpoint.i_crc32
+
+    if not b_resume:
+        o_checkpoint.i_offset = 0
+        o_checkpoint.i_crc32 = 0
+        o_checkpoint.i_target_crc32 = o_patch.i_target_crc32
+
+    # [2/4] Preparing the output file
+    # --------------------------------
+    # Anything written after the last checkpoint is not trusted, so it's discarded.
+    if b_resume:
+        o_out = open(pu_patched, 'r+b')
+        o_out.seek(o_checkpoint.i_offset)
+        o_out.truncate()
+    else:
+        o_out = open(pu_patched, 'wb')
+
+    # [3/4] Writing the chunks
+    # -------------------------
+    try:
+        with open(pu_rom, 'rb') as o_rom:
+            o_records = o_patch.iter_records()
+            ti_record = next(o_records, None)
+
+            i_offset = o_checkpoint.i_offset
+            i_crc32 = o_checkpoint.i_crc32
+            i_resumed_offset = i_offset
+            while i_offset < i_total:
+                i_end = min(i_offset + pi_chunk_size, i_total)
+
+                ab_chunk = _read_view(o_rom, i_offset, i_end - i_offset, pi_rom_offset)
+                # Target bigger than the source, the missing source data is considered to be zeros.
+                if len(ab_chunk) < i_end - i_offset:
+                    ab_chunk += bytearray(i_end - i_offset - len(ab_chunk))
+
+                # Records are in offset order, a record can span several chunks so the part after the chunk is kept
+                # as a new pending record.
+                while ti_record is not None and ti_record[0] < i_end:
+                    i_rec_offset, s_xor = ti_record
+                    i_start = max(i_rec_offset, i_offset)
+                    i_stop = min(i_rec_offset + len(s_xor), i_end)
+                    if i_stop > i_start:
+                        ab_chunk[i_start - i_offset:i_stop - i_offset] = _xor(
+                            bytes(ab_chunk[i_start - i_offset:i_stop - i_offset]),
+                            s_xor[i_start - i_rec_offset:i_stop - i_rec_offset])
+
+                    if i_rec_offset + len(s_xor) > i_end:
+                        ti_record = (i_end, s_xor[i_end - i_rec_offset:])
+                        break
+                    ti_record = next(o_records, None)
+
+                o_out.write(ab_chunk)
+                o_out.flush()
+                os.fsync(o_out.fileno())
+
+                i_crc32 = zlib.crc32(bytes(ab_chunk), i_crc32) & 0xffffffff
+                i_offset = i_end
+
+                o_checkpoint.i_offset = i_offset
+                o_checkpoint.i_crc32 = i_crc32
+                o_checkpoint.write()
+
+                if pf_callback is not None:
+                    pf_callback(i_offset, i_total)
+    finally:
+        o_out.close()
+
+    # [4/4] Final verification
+    # -------------------------
+    # The wrong output is renamed, so it's not mistaken for a good one.
+    if i_crc32 != o_patch.i_target_crc32:
+        o_checkpoint.delete()
+        u_bad = u'%s.%s' % (pu_patched, u_BAD_EXT)
+        os.rename(pu_patched, u_bad)
+        raise ValueError('CRC32 of the patched file (%08x) doesn\'t match the expected one (%08x), output moved to "%s"'
+                         % (i_crc32, o_patch.i_target_crc32, u_bad))
+
+    o_checkpoint.delete()
+
+    return i_crc32, i_resumed_offset
+
+
+def apply_ips(pu_rom, pu_patch, pu_patched, pf_callback=None, pi_rom_offset=0):
+    """
+    Function to apply an IPS patch. The ROM is copied to the output in chunks and then the records are read one by one
+    from the patch and written in order, so the memory used doesn't depend on the size of the ROM or the patch. The ROM
+    and the output must be different files.
+
+    :param pu_rom: Path of the ROM to patch.
+    :param pu_patch: Path of the IPS patch.
+    :param pu_patched: Path of the output patched file.
+    :param pf_callback: Optional function called after each record with two parameters, the number of records applied
+                        and the offset of the last one.
+    :param pi_rom_offset: Offset view of the ROM (see get_rom_offset()) to strip a copier header.
+
+    :type pu_rom: unicode
+    :type pu_patch: unicode
+    :type pu_patched: unicode
+    :type pi_rom_offset: int
+
+    :return: The size of the patched file.
+    """
+    if is_same_file(pu_rom, pu_patched):
+        raise ValueError('The ROM and the output are the same file "%s"' % pu_patched)
+
+    o_patch = IpsPatch(pu_patch)
+
+    with open(pu_rom, 'rb') as o_rom, open(pu_patched, 'w+b') as o_out:
+        # [1/3] Copying the ROM
+        # ----------------------
+        i_offset = 0
+        while True:
+            ab_chunk = _read_view(o_rom, i_offset, i_CHUNK_SIZE, pi_rom_offset)
+            if not ab_chunk:
+                break
+            o_out.write(ab_chunk)
+            i_offset += len(ab_chunk)
+
+        # [2/3] Writing the records
+        # --------------------------
+        # Writing after the end of the file extends it, and the gap is filled with zeros.
+        i_records = 0
+        for i_rec_offset, ab_data in o_patch.iter_records():
+            o_out.seek(i_rec_offset)
+            o_out.write(ab_data)
+            i_records += 1
+            if pf_callback is not None:
+                pf_callback(i_records, i_rec_offset)
+
+        # [3/3] Truncating
+        # -----------------
+        if o_patch.i_truncate is not None:
+            o_out.truncate(o_patch.i_truncate)
+
+        o_out.seek(0, 2)
+        i_size = o_out.tell()
+
+    return i_size
+
+
+def _get_ips_segments(ab_data, pi_offset, pb_rle_compress=True):
+    """
+    Function to split the data of a record in normal and RLE segments. No segment starts at the "EOF" offset.
+
+    :param ab_data: Data of the record.
+    :param pi_offset: Offset of the data in the target file. It must not be the "EOF" offset.
+    :param pb_rle_compress: Whether to use RLE segments or not.
+
+    :return: A list of tuples (start, end, is_rle) with positions inside ab_data.
+    """
+    lti_segments = []
+
+    i_size = len(ab_data)
+    i_normal_start = 0
+    i_pos = 0
+    while pb_rle_compress and i_pos < i_size:
+        i_run_end = i_pos + 1
+        while i_run_end < i_size and ab_data[i_run_end] == ab_data[i_pos] and i_run_end - i_pos < i_IPS_MAX_SIZE:
+            i_run_end += 1
+
+        if i_pos == i_normal_start or i_run_end == i_size:
+            i_rle_min = i_IPS_RLE_MIN_EDGE
+        else:
+            i_rle_min = i_IPS_RLE_MIN
+
+        if i_run_end - i_pos >= i_rle_min:
+            i_run_start = i_pos
+            if pi_offset + i_run_start == i_IPS_EOF_OFFSET:
+                i_run_start += 1
+            if pi_offset + i_run_end == i_IPS_EOF_OFFSET and i_run_end < i_size:
+                i_run_end -= 1
+
+            if i_run_start > i_normal_start:
+                lti_segments.append((i_normal_start, i_run_start, False))
+            lti_segments.append((i_run_start, i_run_end, True))
+            i_normal_start = i_run_end
+
+        i_pos = i_run_end
+
+    if i_normal_start < i_size:
+        lti_segments.append((i_normal_start, i_size, False))
+
+    # Normal segments bigger than the max size of a record are split.
+    lti_split = []
+    for i_start, i_end, b_rle in lti_segments:
+        while not b_rle and i_end - i_start > i_IPS_MAX_SIZE:
+            i_split = i_start + i_IPS_MAX_SIZE
+            if pi_offset + i_split == i_IPS_EOF_OFFSET:
+                i_split -= 1
+            lti_split.append((i_start, i_split, False))
+            i_start = i_split
+        lti_split.append((i_start, i_end, b_rle))
+
+    return lti_split
+
+
+def _write_ips_record(po_patch, po_target, pi_offset, ab_data, pb_rle_compress=True):
+    """
+    Function to write the records for a run of modified bytes of the target file.
+
+    :param po_patch: Patch file object.
+    :param po_target: Target file object, needed to read the previous byte when the run starts at the "EOF" offset.
+    :param pi_offset: Offset of the run in the target file.
+    :param ab_data: Modified bytes.
+    :param pb_rle_compress: Whether to use RLE records or not.
+
+    :return: Nothing
+    """
+    if not ab_data:
+        return
+
+    # A record starting at 0x454f46 would be read as the EOF marker, so the run starts one byte earlier.
+    if pi_offset == i_IPS_EOF_OFFSET:
+        i_position = po_target.tell()
+        po_target.seek(pi_offset - 1)
+        ab_data = bytearray(po_target.read(1)) + ab_data
+        po_target.seek(i_position)
+        pi_offset -= 1
+
+    lti_segments = _get_ips_segments(ab_data, pi_offset, pb_rle_compress)
+
+    for i_start, i_end, b_rle in lti_segments:
+        po_patch.write(struct.pack('>I', pi_offset + i_start)[1:])
+        if b_rle:
+            po_patch.write(struct.pack('>HHB', 0, i_end - i_start, ab_data[i_start]))
+        else:
+            po_patch.write(struct.pack('>H', i_end - i_start))
+            po_patch.write(ab_data[i_start:i_end])
+
+
+def create_ips(pu_source, pu_target, pu_patch, pb_rle_compress=True):
+    """
+    Function to create an IPS patch comparing two files. Both files are read in chunks, so the memory used doesn't
+    depend on their size. When the target is smaller than the source, the truncate extension is used.
+
+    :param pu_source: Path of the original file.
+    :param pu_target: Path of the modified file.
+    :param pu_patch: Path of the IPS patch to create.
+    :param pb_rle_compress: Whether to use RLE records for runs of repeated bytes or not.
+
+    :type pu_source: unicode
+    :type pu_target: unicode
+    :type pu_patch: unicode
+    :type pb_rle_compress: bool
+
+    :return: The size of the patch.
+    """
+    i_source_size = os.path.getsize(pu_source)
+    i_target_size = os.path.getsize(pu_target)
+    if i_target_size > i_IPS_MAX_OFFSET + 1:
+        raise ValueError('Target file too big for an IPS patch "%s" (%i bytes)' % (pu_target, i_target_size))
+
+    with open(pu_source, 'rb') as o_source, open(pu_target, 'rb') as o_target, open(pu_patch, 'wb') as o_patch:
+        o_patch.write(s_IPS_MAGIC)
+
+        # Run of modified bytes being built, it can include up to i_IPS_MAX_GAP unchanged bytes at the end.
+        ab_run = bytearray()
+        i_run_offset = 0
+        i_gap = 0
+
+        i_offset = 0
+        while i_offset < i_target_size:
+            s_target = o_target.read(i_CHUNK_SIZE)
+            s_source = o_source.read(len(s_target))
+
+            for i_block in range(0, len(s_target), i_IPS_COMPARE_BLOCK):
+                s_target_block = s_target[i_block:i_block + i_IPS_COMPARE_BLOCK]
+                s_source_block = s_source[i_block:i_block + i_IPS_COMPARE_BLOCK]
+
+                # Fast path, unchanged block.
+                if s_target_block == s_source_block:
+                    if ab_run:
+                        _write_ips_record(o_patch, o_target, i_run_offset, ab_run[:len(ab_run) - i_gap],
+                                          pb_rle_compress)
+                        ab_run = bytearray()
+                        i_gap = 0
+                    continue
+
+                # Bytes after the end of the source always count as modified, the target must be extended.
+                ab_target_block = bytearray(s_target_block)
+                ab_source_block = bytearray(s_source_block)
+                i_source_block_size = len(ab_source_block)
+                i_block_offset = i_offset + i_block
+                for i_pos in range(len(ab_target_block)):
+                    b_modified = (i_pos >= i_source_block_size) or (ab_target_block[i_pos] != ab_source_block[i_pos])
+
+                    if b_modified:
+                        if not ab_run:
+                            i_run_offset = i_block_offset + i_pos
+                        ab_run.append(ab_target_block[i_pos])
+                        i_gap = 0
+                    elif ab_run:
+                        ab_run.append(ab_target_block[i_pos])
+                        i_gap += 1
+
+                    if ab_run and (i_gap > i_IPS_MAX_GAP or len(ab_run) == i_IPS_MAX_SIZE):
+                        _write_ips_record(o_patch, o_target, i_run_offset, ab_run[:len(ab_run) - i_gap],
+                                          pb_rle_compress)
+                        ab_run = bytearray()
+                        i_gap = 0
+
+            i_offset += len(s_target)
+
+        if ab_run:
+            _write_ips_record(o_patch, o_target, i_run_offset, ab_run[:len(ab_run) - i_gap], pb_rle_compress)
+
+        o_patch.write(s_IPS_EOF)
+        if i_target_size < i_source_size:
+            o_patch.write(struct.pack('>I', i_target_size)[1:])
+
+        i_patch_size = o_patch.tell()
+
+    return i_patch_size
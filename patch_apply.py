@@ -1,8 +1,8 @@
 import argparse
+import os
 
-import selenium.webdriver
-
-import libs.files as files
+# Heavy imports (selenium, libs.files) are deferred until the code that needs them runs, so "--help" or an argument
+# error doesn't pay their cost. Keep it like that, bench_startup.py checks it.
 
 
 # Constants
@@ -14,6 +14,11 @@ u_CHROME_DRIVER_PATH = u'/opt/chromedriver/chromedriver'
 
 u_BROWSER = 'chrome'
 
+tu_ENGINES = (u'browser', u'native')
+i_CHUNK_MB = 16
+
+tu_HEADER_MODES = (u'check', u'fix', u'off')
+
 
 # Classes
 #=======================================================================================================================
@@ -22,6 +27,9 @@ class CmdArgs:
         self.u_rom = u''
         self.u_patch = u''
         self.u_patched = u''
+        self.u_engine = u''
+        self.i_chunk_size = 0
+        self.i_rom_offset = 0
 
         self._read()
 
@@ -33,6 +41,9 @@ class CmdArgs:
         u_out += u'  .u_rom:     %s\n' % self.u_rom
         u_out += u'  .u_patch:   %s\n' % self.u_patch
         u_out += u'  .u_patched: %s\n' % self.u_patched
+        u_out += u'  .u_engine:  %s\n' % self.u_engine
+        u_out += u'  .i_chunk_size: %i\n' % self.i_chunk_size
+        u_out += u'  .i_rom_offset: %i\n' % self.i_rom_offset
         return u_out
 
     def _read(self):
@@ -46,9 +57,30 @@ class CmdArgs:
         o_parser.add_argument('patched',
                               action='store',
                               help='Path of the output patched file. e.g. /home/john/final_result.sfc')
+        o_parser.add_argument('-e', '--engine',
+                              action='store',
+                              choices=tu_ENGINES,
+                              default=tu_ENGINES[0],
+                              help='Patching engine. "browser" uses RomPatcher.js through selenium; "native" applies '
+                                   'UPS patches in chunks, resuming interrupted jobs, and streams IPS patches. '
+                                   'Default: %(default)s')
+        o_parser.add_argument('--chunk-size',
+                              action='store',
+                              type=int,
+                              default=i_CHUNK_MB,
+                              help='Chunk size in MiB for the native engine. Default: %(default)s')
+        o_parser.add_argument('--header',
+                              action='store',
+                              choices=tu_HEADER_MODES,
+                              default=tu_HEADER_MODES[0],
+                              help='Copier header pre-check, only for patches storing the source size and CRC32 (UPS). '
+                                   '"check" rejects ROMs not matching the patch; "fix" also strips the 512-byte header '
+                                   'when that makes the ROM match; "off" skips the check. Default: %(default)s')
 
         o_args = o_parser.parse_args()
 
+        import libs.files as files
+
         o_rom_fp = files.FilePath(o_args.rom).absfile()
         if o_rom_fp.is_file():
             self.u_rom = o_rom_fp.u_path
@@ -67,22 +99,120 @@ class CmdArgs:
         o_patched_fp = files.FilePath(o_args.patched).absfile()
         self.u_patched = o_patched_fp.u_path
 
+        # The output is opened for writing before the ROM is read, using the same file would destroy the ROM.
+        import libs.patches as patches
+
+        if patches.is_same_file(self.u_rom, self.u_patched):
+            print 'ERROR: The patched file can\'t be the same as the ROM "%s"' % o_args.patched
+            quit()
+
+        self.u_engine = o_args.engine
+
+        if o_args.chunk_size > 0:
+            self.i_chunk_size = o_args.chunk_size * 1024 * 1024
+        else:
+            print 'ERROR: Invalid chunk size "%s"' % o_args.chunk_size
+            quit()
+
+        if o_args.header != u'off':
+            self._check_header(b_fix=(o_args.header == u'fix'))
+
+    def _check_header(self, b_fix=False):
+        """
+        Method to check the ROM matches the source expected by the patch, detecting ROMs with or without copier header.
+        It's done before any heavy work so mismatches are rejected (or fixed) as soon as possible.
+
+        :param b_fix: If True, the copier header is stripped when needed instead of rejecting the ROM.
+
+        :return: Nothing
+        """
+        import libs.patches as patches
+
+        try:
+            ti_source = patches.get_source_info(self.u_patch)
+        except ValueError as o_error:
+            print 'ERROR: %s' % o_error
+            quit()
+
+        # Patch formats without source information (e.g. IPS), nothing to check apart from the size.
+        if ti_source is None:
+            if patches.has_copier_header(os.path.getsize(self.u_rom)):
+                print 'WARNING: The ROM seems to have a copier header and the patch can\'t confirm it\'s expected'
+            return
+
+        # The browser engine doesn't verify anything until the whole ROM is uploaded and patched, so the CRC32 is always
+        # checked for it. The native engine verifies the result itself, so big images are not read twice.
+        i_offset = patches.get_rom_offset(self.u_rom, *ti_source, pb_force_crc=(self.u_engine == u'browser'))
+        if i_offset is None:
+            i_source_size = ti_source[0]
+            if (os.path.getsize(self.u_rom) + patches.i_COPIER_HEADER_SIZE == i_source_size
+                    and patches.has_copier_header(i_source_size)):
+                print 'ERROR: The patch expects a copier header the ROM doesn\'t have, adding headers is not supported'
+            else:
+                print 'ERROR: The ROM doesn\'t match the source expected by the patch (size %i, CRC32 %08x)' % ti_source
+            quit()
+
+        elif i_offset != 0:
+            u_message = u'The ROM has a copier header the patch doesn\'t expect'
+            if b_fix:
+                print 'WARNING: %s, stripping it' % u_message
+                self.i_rom_offset = i_offset
+            else:
+                print 'ERROR: %s, use "--header fix"' % u_message
+                quit()
+
     def nice_format(self):
         u_out = u''
         u_out += u'ROM:     %s\n' % self.u_rom
         u_out += u'PATCH:   %s\n' % self.u_patch
-        u_out += u'PATCHED: %s' % self.u_patched
+        u_out += u'PATCHED: %s\n' % self.u_patched
+        u_out += u'ENGINE:  %s' % self.u_engine
         return u_out
 
 
 # Main functions
 #=======================================================================================================================
+def submit_native(po_cmd_args):
+    import libs.patches as patches
+
+    u_format = patches.get_patch_format(po_cmd_args.u_patch)
+
+    try:
+        if u_format == u'ups':
+            def _print_progress(pi_offset, pi_total):
+                print '  %i/%i bytes' % (pi_offset, pi_total)
+
+            i_crc32, i_resumed_offset = patches.apply_ups_chunked(po_cmd_args.u_rom,
+                                                                  po_cmd_args.u_patch,
+                                                                  po_cmd_args.u_patched,
+                                                                  pi_chunk_size=po_cmd_args.i_chunk_size,
+                                                                  pf_callback=_print_progress,
+                                                                  pi_rom_offset=po_cmd_args.i_rom_offset)
+            if i_resumed_offset:
+                print 'Resumed from checkpoint at byte %i' % i_resumed_offset
+            print 'PATCHED! CRC32: %08x' % i_crc32
+
+        elif u_format == u'ips':
+            i_size = patches.apply_ips(po_cmd_args.u_rom,
+                                       po_cmd_args.u_patch,
+                                       po_cmd_args.u_patched,
+                                       pi_rom_offset=po_cmd_args.i_rom_offset)
+            print 'PATCHED! Size: %i bytes' % i_size
+
+        else:
+            print 'ERROR: Patch format not supported by the native engine "%s"' % po_cmd_args.u_patch
+            quit()
+
+    except ValueError as o_error:
+        print 'ERROR: %s' % o_error
+        quit()
+
+
 def submit_selenium(po_cmd_args):
     import re
     import time
 
     from selenium import webdriver
-    from selenium.webdriver.firefox.options import Options
 
     #options.headless = True
 
@@ -99,6 +229,8 @@ def submit_selenium(po_cmd_args):
         o_web_driver = webdriver.Chrome(executable_path=u_CHROME_DRIVER_PATH, options=options)
 
     elif u_BROWSER == 'firefox':
+        from selenium.webdriver.firefox.options import Options
+
         options = Options()
         options.set_preference("browser.download.dir", "/tmp/foo")
         options.set_preference("browser.download.folderList", 2)
@@ -160,4 +292,24 @@ if __name__ == '__main__':
     print o_cmd_args.nice_format()
     print u'%s' % u'-' * len(u_PROG_NAME)
 
-    submit_selenium(o_cmd_args)
\ No newline at end of file
+    if o_cmd_args.u_engine == u'native':
+        submit_native(o_cmd_args)
+
+    # The browser can't use an offset view of the ROM, so a fixed copy is written.
+    elif o_cmd_args.i_rom_offset != 0:
+        import tempfile
+
+        import libs.patches as patches
+
+        u_tmp_dir = tempfile.mkdtemp()
+        u_fixed_rom = os.path.join(u_tmp_dir, os.path.basename(o_cmd_args.u_rom))
+        patches.write_view(o_cmd_args.u_rom, u_fixed_rom, o_cmd_args.i_rom_offset)
+        o_cmd_args.u_rom = u_fixed_rom
+        try:
+            submit_selenium(o_cmd_args)
+        finally:
+            os.remove(u_fixed_rom)
+            os.rmdir(u_tmp_dir)
+
+    else:
+        submit_selenium(o_cmd_args)
\ No newline at end of file
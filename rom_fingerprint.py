@@ -0,0 +1,104 @@
+import argparse
+
+
+# Constants
+#=======================================================================================================================
+u_PROG_NAME = u'ROM fingerprint CLI - v0.1.2020-02-24'
+
+i_THREADS = 4
+
+
+# Classes
+#=======================================================================================================================
+class CmdArgs:
+    def __init__(self):
+        self.lu_paths = []
+        self.b_recursive = False
+        self.tu_exts = ()
+        self.i_threads = 0
+
+        self._read()
+
+    def __str__(self):
+        return unicode(self).encode('utf8')
+
+    def __unicode__(self):
+        u_out = u'<CmdArgs>\n'
+        u_out += u'  .lu_paths:    %s\n' % u', '.join(self.lu_paths)
+        u_out += u'  .b_recursive: %s\n' % self.b_recursive
+        u_out += u'  .tu_exts:     %s\n' % u', '.join(self.tu_exts)
+        u_out += u'  .i_threads:   %i\n' % self.i_threads
+        return u_out
+
+    def _read(self):
+        o_parser = argparse.ArgumentParser()
+        o_parser.add_argument('paths',
+                              action='store',
+                              nargs='+',
+                              help='Files or directories to fingerprint. e.g. /home/john/roms')
+        o_parser.add_argument('-r', '--recursive',
+                              action='store_true',
+                              help='Scan directories recursively.')
+        o_parser.add_argument('-e', '--exts',
+                              action='store',
+                              default=u'',
+                              help='Comma separated list of extensions to keep when scanning directories. e.g. sfc,smc')
+        o_parser.add_argument('-t', '--threads',
+                              action='store',
+                              type=int,
+                              default=i_THREADS,
+                              help='Number of hashing threads. Default: %(default)s')
+
+        o_args = o_parser.parse_args()
+
+        import libs.files as files
+
+        for s_path in o_args.paths:
+            o_fp = files.FilePath(s_path.decode('utf8')).absfile()
+            if o_fp.b_exists:
+                self.lu_paths.append(o_fp.u_path)
+            else:
+                print 'ERROR: Can\'t open "%s"' % s_path
+                quit()
+
+        self.b_recursive = o_args.recursive
+        self.tu_exts = tuple(u_ext.strip() for u_ext in o_args.exts.decode('utf8').split(u',') if u_ext.strip())
+
+        if o_args.threads > 0:
+            self.i_threads = o_args.threads
+        else:
+            print 'ERROR: Invalid number of threads "%s"' % o_args.threads
+            quit()
+
+
+# Main functions
+#=======================================================================================================================
+def fingerprint(po_cmd_args):
+    import libs.files as files
+
+    lo_files_fp = []
+    for u_path in po_cmd_args.lu_paths:
+        o_fp = files.FilePath(u_path)
+        if o_fp.is_file():
+            lo_files_fp.append(o_fp)
+        else:
+            lo_files_fp += o_fp.content(pb_recursive=po_cmd_args.b_recursive, ps_type='files',
+                                        ptu_exts=po_cmd_args.tu_exts)
+
+    for o_fingerprint in files.get_fingerprints(lo_files_fp, pi_threads=po_cmd_args.i_threads):
+        if o_fingerprint.u_error:
+            print (u'ERROR: Can\'t hash "%s": %s' % (o_fingerprint.u_path, o_fingerprint.u_error)).encode('utf8')
+            continue
+
+        u_line = u'%s  %s  %s  %12i  %s' % (o_fingerprint.u_crc32,
+                                           o_fingerprint.u_md5,
+                                           o_fingerprint.u_sha1,
+                                           o_fingerprint.i_size,
+                                           o_fingerprint.u_path)
+        print u_line.encode('utf8')
+
+
+# Main code
+#=======================================================================================================================
+if __name__ == '__main__':
+    fingerprint(CmdArgs())